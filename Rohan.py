@@ -10,6 +10,7 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.types import Message
 import asyncio
 import datetime
+import time
 from config import BOT_TOKEN, ADMIN_ID, COC_API_KEY, BRAWL_API_KEY, CR_API_KEY
 
 # Initialize DB
@@ -25,6 +26,108 @@ dp = Dispatcher()
 router = Router()
 dp.include_router(router)
 
+# Player tag validation and lookup caching
+TAG_ALPHABET = set("0289PYLQGRJCUV")  # Characters Supercell uses in player tags
+NOT_FOUND_TTL = 300  # Seconds to remember an upstream "notFound" result
+FAILED_LOOKUP_WINDOW = 600  # Seconds a failed lookup counts against a user
+MAX_FAILED_LOOKUPS = 5  # Failed lookups allowed per user inside the window
+NOT_FOUND_CACHE_SIZE = 1000  # Max cached "notFound" results, oldest evicted first
+CLEANUP_INTERVAL = 60  # Seconds between sweeps of expired cache and failure entries
+INVALID_TAG_ERROR = "❌ <b>Invalid tag!</b> Tags only use 0289PYLQGRJCUV"
+not_found_cache = {}  # (base_url, tag) -> (expires_at, error), in insertion order
+failed_lookups = {}  # user_id -> [timestamps of failed lookups]
+last_cleanup = 0.0
+
+def normalize_tag(tag):
+    tag = tag.strip().upper().lstrip('#').replace('O', '0')
+    if not tag or any(ch not in TAG_ALPHABET for ch in tag):
+        return None
+    return tag
+
+def prune_lookup_state():
+    global last_cleanup
+    now = time.monotonic()
+    if now - last_cleanup < CLEANUP_INTERVAL and len(not_found_cache) < NOT_FOUND_CACHE_SIZE:
+        return
+    last_cleanup = now
+    for key in [k for k, v in not_found_cache.items() if v[0] <= now]:
+        del not_found_cache[key]
+    while len(not_found_cache) >= NOT_FOUND_CACHE_SIZE:
+        del not_found_cache[next(iter(not_found_cache))]
+    cutoff = now - FAILED_LOOKUP_WINDOW
+    for user_id in list(failed_lookups):
+        recent = [t for t in failed_lookups[user_id] if t > cutoff]
+        if recent:
+            failed_lookups[user_id] = recent
+        else:
+            del failed_lookups[user_id]
+
+def record_failed_lookup(user_id):
+    if user_id is None:
+        return
+    failed_lookups.setdefault(user_id, []).append(time.monotonic())
+
+def is_lookup_blocked(user_id):
+    if user_id is None or user_id == ADMIN_ID:
+        return False
+    cutoff = time.monotonic() - FAILED_LOOKUP_WINDOW
+    recent = [t for t in failed_lookups.get(user_id, []) if t > cutoff]
+    if recent:
+        failed_lookups[user_id] = recent
+    else:
+        failed_lookups.pop(user_id, None)
+    return len(recent) >= MAX_FAILED_LOOKUPS
+
+def migrate_player_tags():
+    # Re-key player_info rows saved before tags were normalized. When both a
+    # raw and a normalized row exist they are merged column by column,
+    # preferring the row with admin-entered data (creation_date).
+    for row in c.execute('SELECT * FROM player_info').fetchall():
+        raw_tag = row[0]
+        normalized = normalize_tag(raw_tag)
+        if normalized == raw_tag:
+            continue
+        if not normalized:
+            print(f"⚠️ player_info tag {raw_tag!r} is not a valid tag, use /viewinfo or /removeinfo with it as typed")
+            continue
+        existing = c.execute('SELECT * FROM player_info WHERE tag=?', (normalized,)).fetchone()
+        if not existing:
+            c.execute('UPDATE player_info SET tag=? WHERE tag=?', (normalized, raw_tag))
+            continue
+        primary, secondary = (row, existing) if row[1] is not None and existing[1] is None else (existing, row)
+        merged = [value if value is not None else fallback for value, fallback in zip(primary[1:], secondary[1:])]
+        c.execute('UPDATE player_info SET creation_date=?, last_seen=?, devices=?, transactions=?, telegram_user_id=?, obstacles=?, skins=? WHERE tag=?',
+                  (*merged, normalized))
+        c.execute('DELETE FROM player_info WHERE tag=?', (raw_tag,))
+        print(f"ℹ️ Merged player_info row {raw_tag!r} into {normalized!r}")
+    conn.commit()
+
+migrate_player_tags()
+
+async def fetch_supercell_player(base_url, headers, tag, user_id=None):
+    # tag must already be normalized, see read_lookup_tag
+    prune_lookup_state()
+    if is_lookup_blocked(user_id):
+        return None, "⏳ <b>Too many failed lookups!</b> Try again in a few minutes."
+    cache_key = (base_url, tag)
+    cached = not_found_cache.get(cache_key)
+    if cached:
+        if cached[0] > time.monotonic():
+            record_failed_lookup(user_id)
+            return None, cached[1]
+        del not_found_cache[cache_key]
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/players/%23{tag}", headers=headers) as resp:
+            data = await resp.json()
+            if 'reason' in data:
+                error = f"❌ Error: {data.get('message', 'Unknown error')}"
+                if data['reason'] == 'notFound':
+                    prune_lookup_state()
+                    not_found_cache[cache_key] = (time.monotonic() + NOT_FOUND_TTL, error)
+                    record_failed_lookup(user_id)
+                return None, error
+            return data, None
+
 # Clash of Clans API Wrapper
 class CoCAPI:
     def __init__(self, api_key):
@@ -44,13 +147,8 @@ class CoCAPI:
             "snake queen": {"month": "2025-02", "hero": "Archer Queen"},
         }
 
-    async def fetch_player(self, tag):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self.base_url69}/players/%23{tag.strip('#')}", headers=self.headers) as resp:
-                data = await resp.json()
-                if 'reason' in data:
-                    return None, f"❌ Error: {data.get('message', 'Unknown error')}"
-                return data, None
+    async def fetch_player(self, tag, user_id=None):
+        return await fetch_supercell_player(self.base_url69, self.headers, tag, user_id)
 
     def infer_last_seen(self, data):
         attack_wins = data.get('attackWins', 0)
@@ -167,26 +265,16 @@ class BrawlAPI:
         self.headers = {"Authorization": f"Bearer {api_key}"}
         self.max_brawlers = 91  # Update if new brawlers are released
 
-    async def fetch_player(self, tag):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self.base_url69}/players/%23{tag.strip('#')}", headers=self.headers) as resp:
-                data = await resp.json()
-                if 'reason' in data:
-                    return None, f"❌ Error: {data.get('message', 'Unknown error')}"
-                return data, None
+    async def fetch_player(self, tag, user_id=None):
+        return await fetch_supercell_player(self.base_url69, self.headers, tag, user_id)
 
 class ClashRoyaleAPI:
     def __init__(self, api_key):
         self.base_url69 = "https://api.clashroyale.com/v1"
         self.headers = {"Authorization": f"Bearer {api_key}"}
 
-    async def fetch_player(self, tag):
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self.base_url69}/players/%23{tag.strip('#')}", headers=self.headers) as resp:
-                data = await resp.json()
-                if 'reason' in data:
-                    return None, f"❌ Error: {data.get('message', 'Unknown error')}"
-                return data, None
+    async def fetch_player(self, tag, user_id=None):
+        return await fetch_supercell_player(self.base_url69, self.headers, tag, user_id)
 
 coc_api = CoCAPI(COC_API_KEY)
 brawl_api = BrawlAPI(BRAWL_API_KEY)
@@ -212,6 +300,13 @@ def add_user(user_id, duration):
     c.execute('INSERT OR REPLACE INTO users (user_id, expire_at) VALUES (?, ?)', (user_id, expire_at.isoformat()))
     conn.commit()
 
+async def read_lookup_tag(message, raw_tag):
+    tag = normalize_tag(raw_tag)
+    if not tag:
+        record_failed_lookup(message.from_user.id)
+        await message.answer(INVALID_TAG_ERROR)
+    return tag
+
 # Handlers
 @router.message(Command("skin"))
 async def set_skins(message: Message):
@@ -222,7 +317,10 @@ async def set_skins(message: Message):
     if len(args) < 3:
         await message.answer("⚠️ Usage: /skin player_tag skin1,skin2,...")
         return
-    tag = args[1]
+    tag = normalize_tag(args[1])
+    if not tag:
+        await message.answer(INVALID_TAG_ERROR)
+        return
     skins = args[2].split(',')
     valid_skins = []
     invalid_skins = []
@@ -262,10 +360,12 @@ async def check_player(message: Message):
     if len(args) < 2:
         await message.answer("⚠️ Usage: /check player_tag [obstacles]")
         return
-    tag = args[1]
+    tag = await read_lookup_tag(message, args[1])
+    if not tag:
+        return
     obstacles = args[2].split(',') if len(args) > 2 else []
 
-    data, error = await coc_api.fetch_player(tag)
+    data, error = await coc_api.fetch_player(tag, message.from_user.id)
     c.execute('SELECT creation_date, last_seen, devices, transactions, telegram_user_id, obstacles, skins FROM player_info WHERE tag=?', (tag,))
     secret_info = c.fetchone()
     if not data:
@@ -333,9 +433,11 @@ async def check_brawl_stars(message: Message):
     if len(args) < 2:
         await message.answer("⚠️ Usage: /check_bs player_tag")
         return
-    tag = args[1]
+    tag = await read_lookup_tag(message, args[1])
+    if not tag:
+        return
 
-    data, error = await brawl_api.fetch_player(tag)
+    data, error = await brawl_api.fetch_player(tag, message.from_user.id)
     if not data:
         await message.answer(error or "❌ <b>Player Not Found!</b>")
         return
@@ -372,9 +474,11 @@ async def check_clash_royale(message: Message):
     if len(args) < 2:
         await message.answer("⚠️ Usage: /check_cr player_tag")
         return
-    tag = args[1]
+    tag = await read_lookup_tag(message, args[1])
+    if not tag:
+        return
 
-    data, error = await clash_royale_api.fetch_player(tag)
+    data, error = await clash_royale_api.fetch_player(tag, message.from_user.id)
     if not data:
         await message.answer(error or "❌ <b>Player Not Found!</b>")
         return
@@ -411,9 +515,11 @@ async def brawler_summary(message: Message):
     if len(args) < 2:
         await message.answer("⚠️ Usage: /brawler player_tag")
         return
-    tag = args[1]
+    tag = await read_lookup_tag(message, args[1])
+    if not tag:
+        return
 
-    data, error = await brawl_api.fetch_player(tag)
+    data, error = await brawl_api.fetch_player(tag, message.from_user.id)
     if not data:
         await message.answer(error or "❌ <b>Player Not Found!</b>")
         return
@@ -443,9 +549,11 @@ async def card_details(message: Message):
     if len(args) < 2:
         await message.answer("⚠️ Usage: /cards player_tag")
         return
-    tag = args[1]
+    tag = await read_lookup_tag(message, args[1])
+    if not tag:
+        return
 
-    data, error = await clash_royale_api.fetch_player(tag)
+    data, error = await clash_royale_api.fetch_player(tag, message.from_user.id)
     if not data:
         await message.answer(error or "❌ <b>Player Not Found!</b>")
         return
@@ -595,7 +703,10 @@ async def link_tag(message: Message):
     if not args:
         await message.answer("⚠️ Usage: /linktag player_tag")
         return
-    tag = args[0]
+    tag = normalize_tag(args[0])
+    if not tag:
+        await message.answer(INVALID_TAG_ERROR)
+        return
     device = coc_api.infer_device(message)
     c.execute('INSERT OR REPLACE INTO player_info (tag, devices, telegram_user_id) VALUES (?, ?, ?)', 
               (tag, device, message.from_user.id))
@@ -613,7 +724,10 @@ async def set_device(message: Message):
     if len(args) < 2:
         await message.answer("⚠️ Usage: /setdevice player_tag device")
         return
-    tag, device = args[0], " ".join(args[1:])
+    tag, device = normalize_tag(args[0]), " ".join(args[1:])
+    if not tag:
+        await message.answer(INVALID_TAG_ERROR)
+        return
     c.execute('UPDATE player_info SET devices=? WHERE tag=? AND telegram_user_id=?', 
               (device, tag, message.from_user.id))
     if c.rowcount > 0:
@@ -631,6 +745,10 @@ async def addinfo(message: Message):
         await message.answer("⚠️ Usage: /addinfo tag creation_date last_seen devices transactions obstacles skins")
         return
     tag, creation_date, last_seen, devices, transactions, obstacles, skins = args[1:]
+    tag = normalize_tag(tag)
+    if not tag:
+        await message.answer(INVALID_TAG_ERROR)
+        return
     c.execute('INSERT OR REPLACE INTO player_info (tag, creation_date, last_seen, devices, transactions, obstacles, skins) VALUES (?, ?, ?, ?, ?, ?, ?)', 
               (tag, creation_date, last_seen, devices, transactions, obstacles, skins))
     conn.commit()
@@ -648,7 +766,8 @@ async def updateinfo(message: Message):
     if args[1] not in allowed_fields:
         await message.answer(f"❌ <b>Invalid field!</b> Use: {', '.join(allowed_fields)}")
         return
-    c.execute(f'UPDATE player_info SET {args[1]}=? WHERE tag=?', (args[2], args[0]))
+    tag = normalize_tag(args[0]) or args[0]
+    c.execute(f'UPDATE player_info SET {args[1]}=? WHERE tag=?', (args[2], tag))
     conn.commit()
     await message.answer("✅ <b>Info Updated!</b>")
 
@@ -660,7 +779,7 @@ async def removeinfo(message: Message):
     if not args:
         await message.answer("⚠️ Usage: /removeinfo tag")
         return
-    tag = args[0]
+    tag = normalize_tag(args[0]) or args[0]
     c.execute('DELETE FROM player_info WHERE tag=?', (tag,))
     conn.commit()
     await message.answer("🗑️ <b>Info Removed!</b>")
@@ -673,7 +792,7 @@ async def viewinfo(message: Message):
     if not args:
         await message.answer("⚠️ Usage: /viewinfo tag")
         return
-    tag = args[0]
+    tag = normalize_tag(args[0]) or args[0]
     c.execute('SELECT * FROM player_info WHERE tag=?', (tag,))
     row = c.fetchone()
     if row:
@@ -0,0 +1,279 @@
+import argparse
+import contextvars
+import datetime
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+# Record/replay harness for the bot handlers
+#
+#   python replay.py record [--corpus DIR]   run the bot live and capture traffic
+#   python replay.py replay [--corpus DIR]   feed the capture through the Dispatcher offline
+#
+# A corpus directory holds a snapshot of database.sqlite taken when recording
+# starts and corpus.jsonl.gz with one line per incoming update. Each line keeps
+# what the update's handler saw while it ran: the fetch_player responses, the
+# keys generate_key returned and every utcnow() value, plus the texts the bot
+# answered. Updates handled concurrently therefore never share recordings.
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+API_NAMES = ('coc_api', 'brawl_api', 'clash_royale_api')
+MISSING = object()
+current_recording = contextvars.ContextVar('current_recording', default=None)
+
+def handler_name(update):
+    text = (update.get('message') or {}).get('text') or ''
+    if not text.startswith('/'):
+        return 'other'
+    return text.split()[0].split('@')[0]
+
+def patch(saved, obj, name, value):
+    saved.append((obj, name, vars(obj).get(name, MISSING)))
+    setattr(obj, name, value)
+
+def restore(saved):
+    for obj, name, value in reversed(saved):
+        if value is MISSING:
+            delattr(obj, name)
+        else:
+            setattr(obj, name, value)
+    saved.clear()
+
+def capture_answers(Rohan, forward=True):
+    from aiogram.methods import SendMessage
+
+    async def middleware(make_request, bot, method):
+        recording = current_recording.get()
+        if recording is not None and isinstance(method, SendMessage):
+            recording['responses'].append(method.text)
+        if forward:
+            return await make_request(bot, method)
+        return None
+
+    return Rohan.bot.session.middleware(middleware)
+
+# Record mode
+def install_recorder(Rohan, write, forward=True):
+    for name in API_NAMES:
+        api = getattr(Rohan, name)
+        original = api.fetch_player
+
+        async def fetch_player(tag, user_id=None, _name=name, _original=original):
+            data, error = await _original(tag, user_id)
+            recording = current_recording.get()
+            if recording is not None:
+                recording['players'].append({'api': _name, 'tag': tag, 'data': data, 'error': error})
+            return data, error
+
+        api.fetch_player = fetch_player
+
+    generate_key = Rohan.generate_key
+
+    def recorded_generate_key():
+        key = generate_key()
+        recording = current_recording.get()
+        if recording is not None:
+            recording['keys'].append(key)
+        return key
+
+    Rohan.generate_key = recorded_generate_key
+
+    clock = Rohan.datetime.datetime
+
+    class RecordingDatetime(clock):
+        @classmethod
+        def utcnow(cls):
+            now = clock.utcnow()
+            recording = current_recording.get()
+            if recording is not None:
+                recording['times'].append(now.isoformat())
+            return now
+
+    Rohan.datetime = types.SimpleNamespace(datetime=RecordingDatetime, timedelta=datetime.timedelta)
+
+    capture_answers(Rohan, forward)
+
+    @Rohan.dp.update.outer_middleware()
+    async def record_update(handler, event, data):
+        recording = {'handled_at': clock.utcnow().isoformat(), 'players': [], 'keys': [], 'times': [], 'responses': []}
+        current_recording.set(recording)
+        try:
+            return await handler(event, data)
+        finally:
+            write({'update': event.model_dump(mode='json', exclude_none=True), **recording})
+
+async def record(corpus_dir):
+    os.makedirs(corpus_dir, exist_ok=True)
+    import Rohan
+
+    snapshot = sqlite3.connect(os.path.join(corpus_dir, 'database.sqlite'))
+    Rohan.conn.backup(snapshot)
+    snapshot.close()
+
+    corpus = gzip.open(os.path.join(corpus_dir, 'corpus.jsonl.gz'), 'wt', encoding='utf-8')
+
+    def write(entry):
+        corpus.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        corpus.flush()
+
+    install_recorder(Rohan, write)
+    try:
+        await Rohan.main()
+    finally:
+        corpus.close()
+
+# Replay mode
+def load_corpus(corpus_dir):
+    with gzip.open(os.path.join(corpus_dir, 'corpus.jsonl.gz'), 'rt', encoding='utf-8') as corpus:
+        return [json.loads(line) for line in corpus]
+
+class ReplayDatetime(datetime.datetime):
+    @classmethod
+    def utcnow(cls):
+        times = current_recording.get()['times']
+        return datetime.datetime.fromisoformat(times.pop(0) if len(times) > 1 else times[0])
+
+def install_playback(Rohan, saved):
+    for name in API_NAMES:
+        async def fetch_player(tag, user_id=None, _name=name):
+            players = current_recording.get()['players']
+            for i, player in enumerate(players):
+                if player['api'] == _name and player['tag'] == tag:
+                    del players[i]
+                    return player['data'], player['error']
+            return None, f"❌ Error: no recording for {_name} {tag}"
+
+        patch(saved, getattr(Rohan, name), 'fetch_player', fetch_player)
+
+    generate_key = Rohan.generate_key
+
+    def recorded_key():
+        keys = current_recording.get()['keys']
+        return keys.pop(0) if keys else generate_key()
+
+    patch(saved, Rohan, 'generate_key', recorded_key)
+    patch(saved, Rohan, 'datetime', types.SimpleNamespace(datetime=ReplayDatetime, timedelta=datetime.timedelta))
+    patch(saved, Rohan, 'not_found_cache', {})
+    patch(saved, Rohan, 'failed_lookups', {})
+    patch(saved, Rohan, 'conn', None)
+    patch(saved, Rohan, 'c', None)
+
+def open_snapshot(Rohan, corpus_dir, workdir):
+    # Every pass starts from the recorded snapshot
+    if Rohan.conn is not None:
+        Rohan.conn.close()
+    path = os.path.join(workdir, 'database.sqlite')
+    shutil.copy(os.path.join(corpus_dir, 'database.sqlite'), path)
+    Rohan.conn = sqlite3.connect(path)
+    Rohan.c = Rohan.conn.cursor()
+    Rohan.not_found_cache.clear()
+    Rohan.failed_lookups.clear()
+
+async def replay_pass(Rohan, updates, stats, trace):
+    from aiogram.types import Update
+
+    mismatches = 0
+    for entry in updates:
+        name = handler_name(entry['update'])
+        update = Update.model_validate(entry['update'], context={'bot': Rohan.bot})
+        recording = {
+            'players': list(entry['players']),
+            'keys': list(entry['keys']),
+            'times': list(entry['times']) or [entry['handled_at']],
+            'responses': [],
+        }
+        current_recording.set(recording)
+        row = stats.setdefault(name, {'calls': 0, 'cpu': 0.0, 'peak': 0, 'net': 0, 'mismatches': 0})
+
+        if trace:
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await Rohan.dp.feed_update(Rohan.bot, update)
+            after, peak = tracemalloc.get_traced_memory()
+            row['peak'] = max(row['peak'], peak - before)
+            row['net'] += after - before
+            continue
+
+        cpu = time.process_time()
+        await Rohan.dp.feed_update(Rohan.bot, update)
+        row['cpu'] += time.process_time() - cpu
+        row['calls'] += 1
+        if recording['responses'] != entry['responses']:
+            row['mismatches'] += 1
+            mismatches += 1
+            print(f"❌ Output mismatch for update {entry['update'].get('update_id')} ({name})")
+            print(f"   expected: {entry['responses']!r}")
+            print(f"   got:      {recording['responses']!r}")
+    current_recording.set(None)
+    return mismatches
+
+async def replay(corpus_dir, trace=True):
+    corpus_dir = os.path.abspath(corpus_dir)
+    updates = load_corpus(corpus_dir)
+
+    # Rohan opens database.sqlite from the working directory on import,
+    # so run against a throwaway copy of the recorded snapshot
+    workdir = tempfile.mkdtemp(prefix='coc-replay-')
+    cwd = os.getcwd()
+    shutil.copy(os.path.join(corpus_dir, 'database.sqlite'), os.path.join(workdir, 'database.sqlite'))
+    os.chdir(workdir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import Rohan
+
+    # Everything patched here is put back afterwards, so the imported
+    # module is left as it was found
+    saved = []
+    install_playback(Rohan, saved)
+    middleware = capture_answers(Rohan, forward=False)
+
+    stats = {}
+    try:
+        # CPU time is measured with tracemalloc off; allocations get their own pass
+        open_snapshot(Rohan, corpus_dir, workdir)
+        mismatches = await replay_pass(Rohan, updates, stats, trace=False)
+        if trace:
+            open_snapshot(Rohan, corpus_dir, workdir)
+            tracemalloc.start()
+            try:
+                await replay_pass(Rohan, updates, stats, trace=True)
+            finally:
+                tracemalloc.stop()
+    finally:
+        if Rohan.conn is not None:
+            Rohan.conn.close()
+        Rohan.bot.session.middleware.unregister(middleware)
+        restore(saved)
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'handler':<14}{'calls':>7}{'cpu ms':>10}{'avg ms':>10}{'peak KiB':>10}{'net KiB':>10}{'diffs':>7}")
+    for name, row in sorted(stats.items()):
+        print(f"{name:<14}{row['calls']:>7}{row['cpu'] * 1000:>10.2f}{row['cpu'] * 1000 / row['calls']:>10.3f}"
+              f"{row['peak'] / 1024:>10.1f}{row['net'] / 1024:>10.1f}{row['mismatches']:>7}")
+    print(f"Replayed {len(updates)} updates, {mismatches} mismatched")
+    return mismatches == 0
+
+def main():
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Record live bot traffic or replay it offline")
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('--corpus', default=os.path.join(REPO_DIR, 'corpus'), help="Corpus directory")
+    parser.add_argument('--no-alloc', action='store_true', help="Skip the tracemalloc allocation pass")
+    args = parser.parse_args()
+
+    if args.mode == 'record':
+        asyncio.run(record(args.corpus))
+    else:
+        sys.exit(0 if asyncio.run(replay(args.corpus, trace=not args.no_alloc)) else 1)
+
+if __name__ == '__main__':
+    main()
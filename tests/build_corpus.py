@@ -0,0 +1,130 @@
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import types
+
+# Regenerates tests/corpus by pushing synthetic updates through the same
+# recording hooks `replay.py record` uses, with canned player payloads, no
+# Telegram traffic and a clock that moves on every utcnow() call, so one
+# update's handler sees several different times.
+#
+#   python tests/build_corpus.py
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+CORPUS_DIR = os.path.join(TESTS_DIR, 'corpus')
+ADMIN = 1866961136
+USER = 4242
+
+PLAYERS = {
+    ('coc_api', 'P0LYJC8C'): ({
+        'tag': '#P0LYJC8C', 'name': 'Rohan <Chief>', 'expLevel': 212, 'townHallLevel': 15,
+        'trophies': 4820, 'attackWins': 61, 'defenseWins': 9, 'donations': 1433,
+        'clan': {'name': 'Night Raiders', 'location': {'name': 'India'}},
+    }, None),
+    ('coc_api', 'Q2RJ0V'): ({
+        'tag': '#Q2RJ0V', 'name': 'newbie', 'expLevel': 34, 'townHallLevel': 7,
+        'trophies': 1210, 'attackWins': 0, 'defenseWins': 0, 'donations': 0,
+    }, None),
+    ('brawl_api', '2PP'): ({
+        'tag': '#2PP', 'name': 'Priya', 'expLevel': 180, 'trophies': 35210, 'highestTrophies': 36044,
+        'club': {'name': 'Spike Club', 'tag': '#8YLL'}, '3vs3Victories': 9120, 'soloVictories': 640,
+        'duoVictories': 810,
+        'brawlers': [
+            {'name': 'SHELLY', 'starPowers': [{'name': 'Shell Shock'}], 'gadgets': [{'name': 'Fast Forward'}]},
+            {'name': 'COLT', 'starPowers': [], 'gadgets': [{'name': 'Speedloader'}]},
+        ],
+    }, None),
+    ('clash_royale_api', '9CQ2U8QJ'): (None, '❌ Error: Not found'),
+}
+
+UPDATES = [
+    (ADMIN, '/start'),
+    (USER, '/check #P0LYJC8C'),
+    (ADMIN, '/key 7day 1'),
+    (USER, '/redeem {key}'),
+    (USER, '/info'),
+    (USER, '/check #p0lyjc8c Clashmas Tree 2014'),
+    (USER, '/check Q2RJOV'),
+    (USER, '/check #XYZ'),
+    (USER, '/check_bs #2PP'),
+    (USER, '/brawler 2PP'),
+    (USER, '/check_cr #9CQ2U8QJ'),
+    (ADMIN, '/skin #P0LYJC8C party queen,not a skin'),
+    (USER, '/check P0LYJC8C'),
+    (USER, '/linktag #Q2RJ0V'),
+    (USER, '/setdevice Q2RJ0V iPad'),
+    (ADMIN, '/viewinfo q2rj0v'),
+]
+
+class Clock(datetime.datetime):
+    now = datetime.datetime(2026, 3, 14, 21, 30)
+
+    @classmethod
+    def utcnow(cls):
+        Clock.now += datetime.timedelta(minutes=40)
+        return Clock.now
+
+def make_update(update_id, user_id, text, date):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(date.replace(tzinfo=datetime.timezone.utc).timestamp()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Tester', 'username': f'user{user_id}'},
+            'text': text,
+        },
+    }
+
+async def build():
+    workdir = tempfile.mkdtemp(prefix='coc-corpus-')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import Rohan
+    import replay
+    from aiogram.types import Update
+
+    os.makedirs(CORPUS_DIR, exist_ok=True)
+    snapshot = sqlite3.connect(os.path.join(CORPUS_DIR, 'database.sqlite'))
+    Rohan.conn.backup(snapshot)
+    snapshot.close()
+
+    for name in replay.API_NAMES:
+        async def fetch_player(tag, user_id=None, _name=name):
+            return PLAYERS.get((_name, tag), (None, '❌ Error: Not found'))
+
+        getattr(Rohan, name).fetch_player = fetch_player
+
+    # Deterministic keys so regenerating the corpus gives the same file
+    keys = iter(['COC-7Q2XKD', 'COC-M4PZ9A', 'COC-B83TRW'])
+    Rohan.generate_key = lambda: next(keys)
+    Rohan.datetime = types.SimpleNamespace(datetime=Clock, timedelta=datetime.timedelta)
+
+    entries = []
+    replay.install_recorder(Rohan, entries.append, forward=False)
+
+    key = None
+    for update_id, (user_id, text) in enumerate(UPDATES, start=1):
+        # Hours pass between updates, so access checks and expiry times move
+        Clock.now += datetime.timedelta(hours=5, minutes=17)
+        raw = make_update(update_id, user_id, text.format(key=key), Clock.now)
+        await Rohan.dp.feed_update(Rohan.bot, Update.model_validate(raw, context={'bot': Rohan.bot}))
+        key = entries[-1]['keys'][-1] if entries[-1]['keys'] else key
+
+    with gzip.open(os.path.join(CORPUS_DIR, 'corpus.jsonl.gz'), 'wt', encoding='utf-8') as corpus:
+        for entry in entries:
+            corpus.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    Rohan.conn.close()
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    asyncio.run(build())
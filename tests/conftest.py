@@ -0,0 +1,20 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+@pytest.fixture(scope='session')
+def Rohan(tmp_path_factory):
+    pytest.importorskip('aiogram')
+    # Rohan opens database.sqlite from the working directory on import
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('rohan'))
+    try:
+        return importlib.import_module('Rohan')
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,126 @@
+import asyncio
+import types
+
+import pytest
+
+BASE_URL = 'https://api.example.test/v1'
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def json(self):
+        return self.payload
+
+class FakeSession:
+    def __init__(self, api):
+        self.api = api
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def get(self, url, headers=None):
+        self.api.urls.append(url)
+        return FakeResponse(self.api.payload)
+
+@pytest.fixture
+def api(Rohan, monkeypatch):
+    fake = types.SimpleNamespace(urls=[], payload={'reason': 'notFound', 'message': 'Not found'}, now=1000.0)
+    monkeypatch.setattr(Rohan.aiohttp, 'ClientSession', lambda: FakeSession(fake))
+    monkeypatch.setattr(Rohan, 'time', types.SimpleNamespace(monotonic=lambda: fake.now))
+    monkeypatch.setattr(Rohan, 'not_found_cache', {})
+    monkeypatch.setattr(Rohan, 'failed_lookups', {})
+    monkeypatch.setattr(Rohan, 'last_cleanup', 0.0)
+    return fake
+
+def fetch(Rohan, tag, user_id=None):
+    return asyncio.run(Rohan.fetch_supercell_player(BASE_URL, {}, tag, user_id))
+
+def test_normalize_tag(Rohan):
+    assert Rohan.normalize_tag(' #p0o2 ') == 'P002'
+    assert Rohan.normalize_tag('2pp') == '2PP'
+    assert Rohan.normalize_tag('#ABC') is None
+    assert Rohan.normalize_tag('#') is None
+
+def test_not_found_is_cached_until_ttl(Rohan, api):
+    data, error = fetch(Rohan, 'P0LY')
+    assert data is None and error == '❌ Error: Not found'
+    assert fetch(Rohan, 'P0LY') == (None, error)
+    assert api.urls == [f'{BASE_URL}/players/%23P0LY']
+
+    api.now += Rohan.NOT_FOUND_TTL
+    fetch(Rohan, 'P0LY')
+    assert len(api.urls) == 2
+
+def test_found_player_is_not_cached(Rohan, api):
+    api.payload = {'tag': '#P0LY', 'name': 'Rohan'}
+    assert fetch(Rohan, 'P0LY') == (api.payload, None)
+    fetch(Rohan, 'P0LY')
+    assert len(api.urls) == 2
+
+def test_repeated_failures_block_until_window_passes(Rohan, api):
+    for i in range(Rohan.MAX_FAILED_LOOKUPS):
+        fetch(Rohan, f'P{i}', user_id=7)
+    data, error = fetch(Rohan, 'Q', user_id=7)
+    assert data is None and 'Too many failed lookups' in error
+    assert len(api.urls) == Rohan.MAX_FAILED_LOOKUPS
+    assert not Rohan.is_lookup_blocked(8)
+
+    api.now += Rohan.FAILED_LOOKUP_WINDOW
+    api.payload = {'tag': '#Q', 'name': 'Back'}
+    assert fetch(Rohan, 'Q', user_id=7) == (api.payload, None)
+    assert 7 not in Rohan.failed_lookups
+
+def test_admin_is_never_blocked(Rohan, api):
+    for i in range(Rohan.MAX_FAILED_LOOKUPS * 2):
+        fetch(Rohan, f'P{i}', user_id=Rohan.ADMIN_ID)
+    assert not Rohan.is_lookup_blocked(Rohan.ADMIN_ID)
+    assert len(api.urls) == Rohan.MAX_FAILED_LOOKUPS * 2
+
+def test_cache_is_bounded(Rohan, api, monkeypatch):
+    monkeypatch.setattr(Rohan, 'NOT_FOUND_CACHE_SIZE', 10)
+    tags = [f'{a}{b}' for a in 'PYLQ' for b in 'GRJCUV']
+    for tag in tags:
+        fetch(Rohan, tag)
+        assert len(Rohan.not_found_cache) <= 10
+    assert (BASE_URL, tags[-1]) in Rohan.not_found_cache
+    assert (BASE_URL, tags[0]) not in Rohan.not_found_cache
+
+def test_stale_failures_are_swept(Rohan, api):
+    fetch(Rohan, 'P0', user_id=7)
+    api.now += max(Rohan.FAILED_LOOKUP_WINDOW, Rohan.CLEANUP_INTERVAL)
+    fetch(Rohan, 'P2', user_id=8)
+    assert 7 not in Rohan.failed_lookups
+    assert (BASE_URL, 'P0') not in Rohan.not_found_cache
+
+def test_migrate_player_tags_merges_rows(Rohan, monkeypatch):
+    import sqlite3
+
+    conn = sqlite3.connect(':memory:')
+    monkeypatch.setattr(Rohan, 'conn', conn)
+    monkeypatch.setattr(Rohan, 'c', conn.cursor())
+    conn.execute('CREATE TABLE player_info (tag TEXT PRIMARY KEY, creation_date TEXT, last_seen TEXT, devices TEXT, transactions TEXT, telegram_user_id INTEGER, obstacles TEXT, skins TEXT)')
+    conn.executemany('INSERT INTO player_info VALUES (?, ?, ?, ?, ?, ?, ?, ?)', [
+        ('#P0LY', '2014-02-01', 'admin seen', None, None, None, None, 'party queen'),
+        ('P0LY', None, 'auto seen', 'iPad', 'none', 42, 'Clashmas Tree 2014', None),
+        ('#yo', None, None, 'Android', None, 43, None, None),
+        ('bad tag!', None, None, 'PC', None, 44, None, None),
+    ])
+
+    Rohan.migrate_player_tags()
+
+    rows = {row[0]: row[1:] for row in conn.execute('SELECT * FROM player_info')}
+    assert rows == {
+        'P0LY': ('2014-02-01', 'admin seen', 'iPad', 'none', 42, 'Clashmas Tree 2014', 'party queen'),
+        'Y0': (None, None, 'Android', None, 43, None, None),
+        'bad tag!': (None, None, 'PC', None, 44, None, None),
+    }
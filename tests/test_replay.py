@@ -0,0 +1,55 @@
+import asyncio
+import gzip
+import json
+import os
+import shutil
+
+import pytest
+
+import replay
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+def write_corpus(corpus_dir, entries):
+    shutil.copy(os.path.join(CORPUS_DIR, 'database.sqlite'), corpus_dir / 'database.sqlite')
+    with gzip.open(corpus_dir / 'corpus.jsonl.gz', 'wt', encoding='utf-8') as corpus:
+        for entry in entries:
+            corpus.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+def test_replay_matches_recorded_output(Rohan):
+    assert asyncio.run(replay.replay(CORPUS_DIR))
+
+def test_replay_reports_changed_output(Rohan, tmp_path, capsys):
+    entries = replay.load_corpus(CORPUS_DIR)
+    info = next(e for e in entries if e['update']['message']['text'] == '/info')
+    info['responses'] = ['stale answer']
+    write_corpus(tmp_path, entries)
+
+    assert not asyncio.run(replay.replay(str(tmp_path), trace=False))
+    assert 'Replayed 16 updates, 1 mismatched' in capsys.readouterr().out
+
+def test_replay_restores_module(Rohan):
+    before = {name: getattr(Rohan, name) for name in
+              ('generate_key', 'datetime', 'conn', 'c', 'not_found_cache', 'failed_lookups')}
+    fetchers = {name: vars(getattr(Rohan, name)).get('fetch_player') for name in replay.API_NAMES}
+    middlewares = len(Rohan.bot.session.middleware)
+
+    assert asyncio.run(replay.replay(CORPUS_DIR, trace=False))
+
+    assert {name: getattr(Rohan, name) for name in before} == before
+    assert {name: vars(getattr(Rohan, name)).get('fetch_player') for name in replay.API_NAMES} == fetchers
+    assert len(Rohan.bot.session.middleware) == middlewares
+    assert not hasattr(Rohan, 'replay_state')
+    Rohan.c.execute('SELECT 1')
+
+@pytest.mark.parametrize('command, field, value', [
+    ('/redeem', 'times', lambda times: times[:1]),
+    ('/key', 'keys', lambda keys: ['COC-OTHER1']),
+])
+def test_replay_plays_back_recorded_values(Rohan, tmp_path, command, field, value):
+    entries = replay.load_corpus(CORPUS_DIR)
+    entry = next(e for e in entries if e['update']['message']['text'].startswith(command))
+    entry[field] = value(entry[field])
+    write_corpus(tmp_path, entries)
+
+    assert not asyncio.run(replay.replay(str(tmp_path), trace=False))